@@ -1,6 +1,8 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import json
+import csv
 from pathlib import Path
 
 st.set_page_config(page_title="Programmatic Assessment - Early Warning MVP v1.1", layout="wide")
@@ -9,18 +11,31 @@ DATA_DIR = Path("./data")
 DATA_DIR.mkdir(exist_ok=True)
 STUDENTS_CSV = DATA_DIR / "students.csv"
 PROGRAMS_CSV = DATA_DIR / "programs.csv"
-SCORES_MASTER_CSV = DATA_DIR / "scores_master.csv"
+SCORES_MASTER_CSV = DATA_DIR / "scores_master.csv"  # 舊版 master，僅讀取
+SCORES_MASTER_PARQUET = DATA_DIR / "scores_master.parquet"
 THRESHOLDS_JSON = DATA_DIR / "thresholds.json"
 FEEDBACKS_CSV = DATA_DIR / "feedbacks.csv"
 ANON_MAP_CSV = DATA_DIR / "anon_map.csv"
 
 SUBJECTS = ["BIOCHEM","MOLBIO"]
 ASSESS_TYPES = ["WEEKLY","MIDTERM","FINAL"]
-
-def load_csv(path: Path, fallback_df: pd.DataFrame) -> pd.DataFrame:
+LIGHTS = ["GRAY","RED","YELLOW","GREEN"]
+SCORE_COLS = ["student_id","week","subject","type","raw_score"]
+# 學號一律當字串讀：上傳、students.csv、舊版 master 與回饋的型別一致，merge / 去重才對得上
+ID_DTYPE = {"student_id": str}
+# 成績表的文字欄在讀檔（cache 內）就轉成 category，rerun 時不必每次重新編碼
+SCORE_DTYPES = {"subject": "category", "type": "category"}
+
+@st.cache_data(show_spinner=False)
+def load_csv_cached(path_str: str, mtime: int, size: int, dtype: dict | None = None) -> pd.DataFrame:
+    # mtime 與檔案大小只當 cache key：檔案有變才重讀（時間戳粗的檔案系統上，追加後 mtime 可能不變，大小一定變）
+    return pd.read_csv(path_str, dtype={**ID_DTYPE, **(dtype or {})})
+
+def load_csv(path: Path, fallback_df: pd.DataFrame, dtype: dict | None = None) -> pd.DataFrame:
     if path.exists():
         try:
-            return pd.read_csv(path)
+            stat = path.stat()
+            return load_csv_cached(str(path), stat.st_mtime_ns, stat.st_size, dtype)
         except Exception as e:
             st.warning(f"⚠️ 無法讀取 {path.name}：{e}，改用暫存資料。")
             return fallback_df.copy()
@@ -30,6 +45,33 @@ def save_csv(df: pd.DataFrame, path: Path):
     path.parent.mkdir(parents=True, exist_ok=True)
     df.to_csv(path, index=False)
 
+@st.cache_data(show_spinner=False)
+def load_parquet_cached(path_str: str, mtime: int) -> pd.DataFrame:
+    return pd.read_parquet(path_str).astype(SCORE_DTYPES)
+
+def load_scores_master(fallback_df: pd.DataFrame) -> pd.DataFrame:
+    if SCORES_MASTER_PARQUET.exists():
+        try:
+            return load_parquet_cached(str(SCORES_MASTER_PARQUET), SCORES_MASTER_PARQUET.stat().st_mtime_ns)
+        except Exception as e:
+            st.warning(f"⚠️ 無法讀取 {SCORES_MASTER_PARQUET.name}：{e}，改用暫存資料。")
+            return fallback_df.astype(SCORE_DTYPES)
+    # 尚未轉成 parquet 的舊資料夾：沿用 CSV master
+    if SCORES_MASTER_CSV.exists():
+        return load_csv(SCORES_MASTER_CSV, fallback_df.astype(SCORE_DTYPES), SCORE_DTYPES)
+    return fallback_df.astype(SCORE_DTYPES)
+
+def save_scores_master(df: pd.DataFrame):
+    SCORES_MASTER_PARQUET.parent.mkdir(parents=True, exist_ok=True)
+    df.to_parquet(SCORES_MASTER_PARQUET, index=False, compression="zstd")
+
+def read_scores_upload(f) -> pd.DataFrame:
+    # 先讀表頭把欄名轉小寫，解析時就只取需要的欄位並指定文字欄型別
+    names = [c.lower() for c in pd.read_csv(f, nrows=0).columns]
+    f.seek(0)
+    return pd.read_csv(f, header=0, names=names, usecols=lambda c: c in SCORE_COLS,
+                       dtype={**ID_DTYPE, "subject": str, "type": str})
+
 def load_thresholds():
     if THRESHOLDS_JSON.exists():
         try:
@@ -55,48 +97,48 @@ def init_defaults():
     feedbacks = pd.DataFrame(columns=["student_id","assessment_key","note","author"])
     return students, programs, scores, feedbacks
 
-def color_light(score, red_max, yellow_max):
-    if pd.isna(score):
-        return "GRAY"
-    if score <= red_max:
-        return "RED"
-    if score <= yellow_max:
-        return "YELLOW"
-    return "GREEN"
+def classify_light(score: pd.Series, red_max, yellow_max) -> pd.Series:
+    # ≤ red_max → RED；≤ yellow_max → YELLOW；其餘 GREEN；無分數 → GRAY
+    if yellow_max > red_max:
+        bins, labels = [-np.inf, red_max, yellow_max, np.inf], ["RED","YELLOW","GREEN"]
+    else:
+        bins, labels = [-np.inf, red_max, np.inf], ["RED","GREEN"]
+    light = pd.cut(score, bins=bins, labels=labels)
+    return light.cat.set_categories(LIGHTS, ordered=True).fillna("GRAY")
 
 def apply_thresholds(scores_df, thresholds, students_df):
     # merge program to each score
     merged = scores_df.merge(students_df[["student_id","program"]], on="student_id", how="left")
-    def get_pair(row):
-        prog = row.get("program", None)
-        if prog and prog in thresholds.get("by_program", {}):
-            r = thresholds["by_program"][prog]["red_max"]
-            y = thresholds["by_program"][prog]["yellow_max"]
-        else:
-            r = thresholds["global"]["red_max"]
-            y = thresholds["global"]["yellow_max"]
-        return pd.Series({"red_max": r, "yellow_max": y})
-    if len(merged):
-        merged = pd.concat([merged, merged.apply(get_pair, axis=1)], axis=1)
-        merged["light"] = merged.apply(lambda r: color_light(r["raw_score"], r["red_max"], r["yellow_max"]), axis=1)
-    else:
-        merged["red_max"] = []
-        merged["yellow_max"] = []
-        merged["light"] = []
-    # add an assessment key for feedback tying
-    if len(merged):
-        merged["assessment_key"] = merged.apply(lambda r: f"{r['week']:02d}-{r['subject']}-{r['type']}", axis=1)
+    merged["program"] = merged["program"].astype("category")
+    # per-program thresholds; programs without override fall back to global
+    by_program = thresholds.get("by_program", {})
+    for col in ["red_max","yellow_max"]:
+        override = {p: v[col] for p, v in by_program.items()}
+        col_values = merged["program"].map(override).astype(float).fillna(thresholds["global"][col])
+        # 門檻設定都是整數時轉回整數，明細表與匯出才不會顯示成 40.0
+        if all(isinstance(v, int) for v in [thresholds["global"][col], *override.values()]):
+            col_values = col_values.astype(int)
+        merged[col] = col_values
+    # 先用全域門檻一次分箱，再只改寫有覆寫門檻的系所
+    score = merged["raw_score"].astype(float)
+    light = classify_light(score, thresholds["global"]["red_max"], thresholds["global"]["yellow_max"])
+    for prog, v in by_program.items():
+        rows = (merged["program"] == prog).to_numpy()
+        if rows.any():
+            light.loc[rows] = classify_light(score[rows], v["red_max"], v["yellow_max"])
+    merged["light"] = light
     return merged
 
 def weekly_stack(merged):
     if len(merged)==0:
         return pd.DataFrame()
-    ct = merged.pivot_table(index="week", columns="light", values="raw_score", aggfunc="count").fillna(0).reset_index()
-    # ensure column order
-    for col in ["RED","YELLOW","GREEN"]:
-        if col not in ct.columns:
-            ct[col] = 0
-    return ct.sort_values("week")
+    # groupby.size 走專用的計數路徑，比 pivot_table(aggfunc="count") 快
+    ct = (
+        merged.groupby(["week","light"], observed=True).size()
+              .unstack("light", fill_value=0)
+              .reindex(columns=["RED","YELLOW","GREEN"], fill_value=0)
+    )
+    return ct.reset_index().sort_values("week")
 
 def mid_final_scatter(merged):
     if len(merged)==0:
@@ -115,23 +157,17 @@ def risk_snapshot_basic(merged):
     if len(wk)==0:
         return pd.DataFrame(columns=["student_id","risk_reason"])
     wk = wk.sort_values(["student_id","week"])
-    def risk_for(student_df):
-        s = student_df["light"].tolist()
-        cons_red = cons_yellow = max_red = max_yellow = 0
-        for val in s:
-            if val=="RED":
-                cons_red += 1; cons_yellow = 0
-            elif val=="YELLOW":
-                cons_yellow += 1; cons_red = 0
-            else:
-                cons_red = cons_yellow = 0
-            max_red = max(max_red, cons_red)
-            max_yellow = max(max_yellow, cons_yellow)
-        reasons = []
-        if max_red >= 2: reasons.append("連續≥2 週紅燈")
-        if max_yellow >= 3: reasons.append("連續≥3 週黃燈")
-        return "; ".join(reasons)
-    risks = wk.groupby("student_id").apply(risk_for).reset_index(name="risk_reason")
+    # 每段連續相同燈號給一個 run id（換學生也斷開），再算每段長度
+    run_id = (wk["light"].ne(wk["light"].shift()) | wk["student_id"].ne(wk["student_id"].shift())).cumsum()
+    runs = wk.assign(_run=run_id).groupby(["student_id","_run","light"], sort=False, observed=True).size().reset_index(name="run")
+    longest = runs.pivot_table(index="student_id", columns="light", values="run", aggfunc="max", observed=True)
+    longest = longest.reindex(index=wk["student_id"].unique(), columns=["RED","YELLOW"]).fillna(0)
+    red_hit = (longest["RED"] >= 2).to_numpy()
+    yellow_hit = (longest["YELLOW"] >= 3).to_numpy()
+    reason = np.where(red_hit & yellow_hit, "連續≥2 週紅燈; 連續≥3 週黃燈",
+             np.where(red_hit, "連續≥2 週紅燈",
+             np.where(yellow_hit, "連續≥3 週黃燈", "")))
+    risks = pd.DataFrame({"student_id": longest.index, "risk_reason": reason})
     risks = risks[risks["risk_reason"]!=""]
     return risks
 
@@ -146,36 +182,54 @@ def risk_snapshot_advanced(merged, thresholds):
     mid_low = thresholds.get("advanced",{}).get("mid_low",60)
     final_low = thresholds.get("advanced",{}).get("final_low",60)
     cross_gap = thresholds.get("advanced",{}).get("cross_gap",20)
-    # per-student weekly mean (兩科合併)
-    wk = merged[merged["type"]=="WEEKLY"]
-    weekly_mean = wk.groupby("student_id")["raw_score"].mean().rename("weekly_mean")
-    # mid/final mean (兩科)
-    mid = merged[merged["type"]=="MIDTERM"].groupby("student_id")["raw_score"].mean().rename("mid_mean")
-    fin = merged[merged["type"]=="FINAL"].groupby("student_id")["raw_score"].mean().rename("final_mean")
+    # 一次 groupby 取得每人 週考/期中/期末 平均（兩科合併）
+    means = merged.groupby(["student_id","type"], observed=True)["raw_score"].mean().unstack("type")
+    means = means.reindex(columns=ASSESS_TYPES)
     # cross-subject gap on weekly means
-    by_subj = wk.groupby(["student_id","subject"])["raw_score"].mean().unstack(fill_value=float("nan"))
-    if "BIOCHEM" not in by_subj.columns: by_subj["BIOCHEM"] = float("nan")
-    if "MOLBIO" not in by_subj.columns: by_subj["MOLBIO"] = float("nan")
-    by_subj["cross_gap"] = (by_subj["BIOCHEM"] - by_subj["MOLBIO"]).abs()
-
-    df = pd.DataFrame(weekly_mean).join([mid, fin, by_subj["cross_gap"]])
-    df = df.fillna({"mid_mean": float("nan"), "final_mean": float("nan"), "cross_gap": float("nan")})
-
-    def reason(row):
-        rs = []
-        if pd.notna(row["weekly_mean"]) and pd.notna(row["mid_mean"]):
-            if row["weekly_mean"] >= g_yellow and row["mid_mean"] < mid_low:
-                rs.append(f"週考高分(≥{g_yellow})但期中偏低(<{mid_low})")
-        if pd.notna(row["weekly_mean"]) and pd.notna(row["final_mean"]):
-            if row["weekly_mean"] >= g_yellow and row["final_mean"] < final_low:
-                rs.append(f"週考高分(≥{g_yellow})但期末偏低(<{final_low})")
-        if pd.notna(row["cross_gap"]) and row["cross_gap"] >= cross_gap:
-            rs.append(f"跨科落差≥{cross_gap}")
-        return "; ".join(rs)
-    df["adv_reason"] = df.apply(reason, axis=1)
+    wk = merged[merged["type"]=="WEEKLY"]
+    by_subj = wk.pivot_table(index="student_id", columns="subject", values="raw_score", aggfunc="mean", observed=True)
+    by_subj = by_subj.reindex(columns=SUBJECTS)
+
+    # 只看有週考紀錄的學生
+    df = pd.DataFrame({
+        "weekly_mean": means["WEEKLY"],
+        "mid_mean": means["MIDTERM"],
+        "final_mean": means["FINAL"],
+        "cross_gap": (by_subj["BIOCHEM"] - by_subj["MOLBIO"]).abs(),
+    })
+    df = df[df.index.isin(wk["student_id"].unique())]
+
+    # NaN 比較結果為 False，等同原本的 notna 檢查
+    high_weekly = df["weekly_mean"] >= g_yellow
+    def part(mask, text):
+        return pd.Series(np.where(mask, text + "; ", ""), index=df.index)
+    df["adv_reason"] = (
+        part(high_weekly & (df["mid_mean"] < mid_low), f"週考高分(≥{g_yellow})但期中偏低(<{mid_low})")
+        + part(high_weekly & (df["final_mean"] < final_low), f"週考高分(≥{g_yellow})但期末偏低(<{final_low})")
+        + part(df["cross_gap"] >= cross_gap, f"跨科落差≥{cross_gap}")
+    ).str.removesuffix("; ")
     out = df[ df["adv_reason"]!="" ][["adv_reason"]].reset_index()
     return out
 
+def file_mtime(path: Path) -> int:
+    return path.stat().st_mtime_ns if path.exists() else 0
+
+def frame_hash(df: pd.DataFrame) -> int:
+    return int(pd.util.hash_pandas_object(df, index=False).sum())
+
+# 以下 cache 版本以 hash / json 字串當 key；底線開頭的參數不參與 Streamlit 的雜湊
+@st.cache_data(show_spinner=False)
+def compute_merged(_scores_df, _students_df, scores_hash, students_hash, thresholds_json):
+    return apply_thresholds(_scores_df, json.loads(thresholds_json), _students_df)
+
+@st.cache_data(show_spinner=False)
+def compute_risk_basic(_merged, merged_hash):
+    return risk_snapshot_basic(_merged)
+
+@st.cache_data(show_spinner=False)
+def compute_risk_advanced(_merged, merged_hash, thresholds_json):
+    return risk_snapshot_advanced(_merged, json.loads(thresholds_json))
+
 def ensure_feedbacks_csv():
     if not FEEDBACKS_CSV.exists():
         pd.DataFrame(columns=["student_id","assessment_key","note","author"]).to_csv(FEEDBACKS_CSV, index=False)
@@ -183,44 +237,60 @@ def ensure_feedbacks_csv():
 def load_feedbacks():
     ensure_feedbacks_csv()
     try:
-        return pd.read_csv(FEEDBACKS_CSV)
+        stat = FEEDBACKS_CSV.stat()
+        return load_csv_cached(str(FEEDBACKS_CSV), stat.st_mtime_ns, stat.st_size)
     except Exception:
         return pd.DataFrame(columns=["student_id","assessment_key","note","author"])
 
 def save_feedback(student_id, assessment_key, note, author):
-    fb = load_feedbacks()
-    fb.loc[len(fb)] = {"student_id":student_id, "assessment_key":assessment_key, "note":note, "author":author}
-    save_csv(fb, FEEDBACKS_CSV)
+    ensure_feedbacks_csv()
+    # 只追加一列，不重讀/重寫整個檔案；檔案大小改變後 load_feedbacks 會自動重讀
+    with open(FEEDBACKS_CSV, "a", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerow([student_id, assessment_key, note, author])
+
+def assessment_key(week, subject, atype):
+    # feedbacks.csv 內的評量鍵，例："01-BIOCHEM-WEEKLY"
+    return f"{int(week):02d}-{subject}-{atype}"
+
+def assessment_label(key):
+    week, subject, atype = key
+    return f"W{int(week)} {subject} {atype}"
+
+def split_assessment_keys(fb):
+    # assessment_key -> week / subject / type，回饋可直接依這三欄排序與顯示
+    parts = fb["assessment_key"].astype(str).str.extract(r"^(\d+)-([^-]+)-(.+)$")
+    return fb.assign(week=pd.to_numeric(parts[0], errors="coerce"), subject=parts[1], type=parts[2])
 
 def get_assessment_keys(merged):
     if len(merged)==0:
         return []
-    keys = merged[["assessment_key","week","subject","type"]].drop_duplicates().sort_values(["week","subject","type"])
-    keys["label"] = keys.apply(lambda r: f"W{int(r['week'])} {r['subject']} {r['type']} ({r['assessment_key']})", axis=1)
-    return keys
+    keys = merged[["week","subject","type"]].drop_duplicates().sort_values(["week","subject","type"])
+    return list(keys.itertuples(index=False, name=None))
 
 def generate_anon_map(students_df):
     # create or extend anon_map.csv: student_id -> S0001...
     if ANON_MAP_CSV.exists():
-        amap = pd.read_csv(ANON_MAP_CSV)
+        amap = pd.read_csv(ANON_MAP_CSV, dtype=ID_DTYPE)
     else:
         amap = pd.DataFrame(columns=["student_id","anon_id"])
-    existing = set(amap["student_id"]) if len(amap) else set()
-    next_idx = len(amap) + 1
-    rows = []
-    for sid in students_df["student_id"].astype(str):
-        if sid not in existing:
-            rows.append({"student_id":sid, "anon_id": f"S{next_idx:04d}"})
-            next_idx += 1
-    if rows:
-        amap = pd.concat([amap, pd.DataFrame(rows)], ignore_index=True)
+    sids = students_df["student_id"].astype(str)
+    new_ids = sids[~sids.isin(amap["student_id"])].unique()
+    if len(new_ids):
+        next_idx = len(amap) + 1
+        rows = pd.DataFrame({"student_id": new_ids, "anon_id": [f"S{i:04d}" for i in range(next_idx, next_idx + len(new_ids))]})
+        amap = pd.concat([amap, rows], ignore_index=True) if len(amap) else rows
         save_csv(amap, ANON_MAP_CSV)
     return amap
 
+@st.cache_data(show_spinner=False)
+def load_anon_map(_students_df, students_mtime: int, anon_mtime: int) -> pd.DataFrame:
+    # 名單與對照表都沒變 → 直接沿用，不重讀 anon_map.csv、不重掃學號
+    return generate_anon_map(_students_df)
+
 def anonymize_view(df, students_df):
     if len(df)==0:
         return pd.DataFrame()
-    amap = generate_anon_map(students_df)
+    amap = load_anon_map(students_df, file_mtime(STUDENTS_CSV), file_mtime(ANON_MAP_CSV))
     out = df.merge(amap, on="student_id", how="left")
     cols = ["anon_id","week","subject","type","raw_score","light"]
     if "program" in out.columns:
@@ -237,7 +307,7 @@ with st.sidebar:
     # Upload students.csv
     up_students = st.file_uploader("上傳 students.csv", type=["csv"], key="stu_up")
     if up_students is not None:
-        df = pd.read_csv(up_students)
+        df = pd.read_csv(up_students, dtype=ID_DTYPE)
         save_csv(df, STUDENTS_CSV)
         st.success(f"students.csv 已更新（{len(df)} 筆）")
 
@@ -256,16 +326,12 @@ with st.sidebar:
         new_rows = []
         for f in uploaded_scores:
             try:
-                df = pd.read_csv(f)
-                new_rows.append(df)
+                new_rows.append(read_scores_upload(f))
             except Exception as e:
                 st.error(f"{f.name} 讀取失敗：{e}")
         if new_rows:
             new_scores = pd.concat(new_rows, ignore_index=True)
-            # standardize columns
-            new_scores.columns = [c.lower() for c in new_scores.columns]
-            required = {"student_id","week","subject","type","raw_score"}
-            if required - set(new_scores.columns):
+            if set(SCORE_COLS) - set(new_scores.columns):
                 st.error("上傳 CSV 欄位需包含：student_id, week, subject, type, raw_score")
             else:
                 new_scores["subject"] = new_scores["subject"].str.upper().str.strip()
@@ -277,18 +343,11 @@ with st.sidebar:
                     st.warning(f"有 {len(new_scores[~ok])} 筆資料不合法（已忽略）。")
                 new_scores = new_scores[ok]
                 # upsert
-                if SCORES_MASTER_CSV.exists():
-                    master = pd.read_csv(SCORES_MASTER_CSV)
-                else:
-                    master = pd.DataFrame(columns=["student_id","week","subject","type","raw_score"])
-                new_scores = new_scores.drop_duplicates(subset=["student_id","week","subject","type"], keep="last")
-                if len(master):
-                    key_cols = ["student_id","week","subject","type"]
-                    master = master[~master.set_index(key_cols).index.isin(new_scores.set_index(key_cols).index)]
-                    master = pd.concat([master, new_scores], ignore_index=True)
-                else:
-                    master = new_scores.copy()
-                save_csv(master, SCORES_MASTER_CSV)
+                master = load_scores_master(pd.DataFrame(columns=["student_id","week","subject","type","raw_score"]))
+                # 新上傳的放在後面，同一 key 保留最後一筆 → 新資料覆蓋舊資料
+                master = pd.concat([master, new_scores], ignore_index=True) if len(master) else new_scores
+                master = master.drop_duplicates(subset=["student_id","week","subject","type"], keep="last", ignore_index=True)
+                save_scores_master(master)
                 st.success(f"已合併寫入 master（目前共 {len(master)} 筆）")
 
     st.divider()
@@ -325,8 +384,7 @@ with st.sidebar:
 students, programs, scores, feedbacks = init_defaults()
 students = load_csv(STUDENTS_CSV, students)
 programs = load_csv(PROGRAMS_CSV, programs)
-if SCORES_MASTER_CSV.exists():
-    scores = pd.read_csv(SCORES_MASTER_CSV)
+scores = load_scores_master(scores)
 feedbacks = load_feedbacks()
 thresholds = load_thresholds()
 
@@ -343,7 +401,13 @@ with c4:
     light_filter = st.multiselect("燈號", ["RED","YELLOW","GREEN"])
 
 # Merge + compute light
-merged = apply_thresholds(scores, thresholds, students)
+thresholds_json = json.dumps(thresholds, sort_keys=True)
+# 只有資料檔或門檻變動才重算；單純調整篩選的 rerun 直接沿用 session 內的結果
+merged_sig = (file_mtime(STUDENTS_CSV), file_mtime(SCORES_MASTER_PARQUET), file_mtime(SCORES_MASTER_CSV), thresholds_json)
+if st.session_state.get("_merged_sig") != merged_sig:
+    st.session_state["_merged"] = compute_merged(scores, students, frame_hash(scores), frame_hash(students), thresholds_json)
+    st.session_state["_merged_sig"] = merged_sig
+merged = st.session_state["_merged"]
 
 # Apply filters
 if len(merged):
@@ -378,7 +442,8 @@ with cB:
 # ---- Risk snapshot ----
 st.divider()
 st.markdown("### 風險快照（連續紅/黃）")
-risk_basic = risk_snapshot_basic(merged)
+merged_hash = frame_hash(merged)
+risk_basic = compute_risk_basic(merged, merged_hash)
 if len(risk_basic):
     risk_basic = risk_basic.merge(students[["student_id","name","program"]], on="student_id", how="left")
     st.dataframe(risk_basic[["student_id","name","program","risk_reason"]].sort_values(["program","student_id"]))
@@ -386,7 +451,7 @@ else:
     st.info("目前沒有連續紅/黃的風險個案。")
 
 st.markdown("### 落差偵測（週考 vs 期中/期末、跨科差距）")
-risk_adv = risk_snapshot_advanced(merged, thresholds)
+risk_adv = compute_risk_advanced(merged, merged_hash, thresholds_json)
 if len(risk_adv):
     risk_adv = risk_adv.merge(students[["student_id","name","program"]], on="student_id", how="left")
     st.dataframe(risk_adv[["student_id","name","program","adv_reason"]].sort_values(["program","student_id"]))
@@ -404,26 +469,17 @@ else:
     with cfb1:
         sid = st.selectbox("選擇學生", students["student_id"].astype(str).tolist())
         keys = get_assessment_keys(merged[merged["student_id"]==sid])
-        key_options = keys["label"].tolist() if len(keys) else []
-        label = st.selectbox("選擇評量", key_options)
+        akey = st.selectbox("選擇評量", keys, format_func=assessment_label)
         note = st.text_area("回饋內容（可含學習建議）", height=120, placeholder="例：建議補強脂質代謝章節；週內安排30分鐘題庫練習。")
         author = st.text_input("回饋撰寫者（顯示名）", value="Teacher")
-        if st.button("新增回饋", type="primary", use_container_width=True, disabled=(not label or not note.strip())):
-            # parse assessment_key from label tail "(xx)"
-            if label and "(" in label and label.endswith(")"):
-                akey = label.split("(")[-1][:-1]
-            else:
-                akey = ""
-            save_feedback(sid, akey, note.strip(), author.strip() or "Teacher")
+        if st.button("新增回饋", type="primary", use_container_width=True, disabled=(akey is None or not note.strip())):
+            save_feedback(sid, assessment_key(*akey), note.strip(), author.strip() or "Teacher")
             st.success("已新增回饋。")
     with cfb2:
         st.markdown("### 該生回饋列表")
         fb = load_feedbacks()
         if len(fb):
-            fb_view = fb[fb["student_id"]==sid].merge(
-                merged[["student_id","assessment_key","week","subject","type"]].drop_duplicates(),
-                on=["student_id","assessment_key"], how="left"
-            ).sort_values(["week","subject","type"])
+            fb_view = split_assessment_keys(fb[fb["student_id"]==sid]).sort_values(["week","subject","type"])
             if len(fb_view):
                 st.dataframe(fb_view[["week","subject","type","note","author"]])
             else:
@@ -1,6 +1,11 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import json
+import pyarrow as pa
+import pyarrow.parquet as pq
 from io import BytesIO
+from functools import partial
 from pathlib import Path
 
 st.set_page_config(page_title="成績預警儀表板", layout="wide")
@@ -53,10 +58,78 @@ with st.sidebar:
         type=["xlsx"]
     )
 
-@st.cache_data(show_spinner=False)
+REQUIRED_COLS = {"ID", "Biochem", "MolBio", "Week"}
+
+# Excel 解析：有 python-calamine（Rust 實作）就用，較 openpyxl 快；沒有則退回 openpyxl
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = "openpyxl"
+
+SCORE_CACHE_NAME = "_score_cache.parquet"
+# clean_score_df 的輸出（欄位 / 型別 / 排序）有變就遞增，舊 sidecar 自動作廢
+SCORE_CACHE_VERSION = 2
+SCORE_CACHE_META_KEY = b"score_cache_source"
+
+def score_cache_tag(src: Path) -> bytes:
+    # 寫進 parquet metadata：來源檔名、mtime、大小與清理版本都相符才沿用 sidecar
+    stat = src.stat()
+    return json.dumps({
+        "source": src.name,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "version": SCORE_CACHE_VERSION,
+    }, sort_keys=True).encode()
+
+def clean_score_df(df: pd.DataFrame) -> pd.DataFrame:
+    # 欄位不齊就原樣回傳，交給下方的欄位檢查顯示錯誤
+    if not REQUIRED_COLS.issubset(df.columns):
+        return df
+    # Name 欄可選；若沒有則補空白
+    if "Name" not in df.columns:
+        df["Name"] = ""
+    # 轉型（不在這裡排序：pivot 會自行排好 ID，需要「最早一週」的地方只依 Week 排）
+    df["Week"] = pd.to_numeric(df["Week"], errors="coerce").astype("Int64")
+    df = df.dropna(subset=["Week"]).copy()
+    # 週次只有 1–18：downcast 成 int8，pivot / 篩選時少搬 7/8 的位元組
+    df["Week"] = pd.to_numeric(df["Week"].astype(int), downcast="integer")
+    return df
+
+# 讀檔快取：預設檔以路徑 + mtime 為 key（檔案更新即失效），上傳檔以內容為 key
+# 用 cache_resource 讓同一份解析結果常駐、跨 rerun / session 共用（不再每次反序列化複本）；
+# 回傳的是共用物件，呼叫端須先（淺）copy 再加欄位；max_entries 限制常駐的份數
+@st.cache_resource(show_spinner=False, max_entries=2)
+def load_default_score_df(path_str: str, mtime: int) -> pd.DataFrame:
+    # 同目錄的 parquet 若是由這份 xlsx、這版清理流程產生的，就直接讀（冷啟動免解析 Excel）；
+    # 只比 mtime 先後不夠：cp -p / rsync / 解壓縮還原的舊檔 mtime 可能更早
+    src = Path(path_str)
+    cache = src.with_name(SCORE_CACHE_NAME)
+    tag = score_cache_tag(src)
+    if cache.exists():
+        try:
+            if (pq.read_schema(cache).metadata or {}).get(SCORE_CACHE_META_KEY) == tag:
+                return pd.read_parquet(cache)
+        except Exception:
+            pass  # 損毀或非 parquet：重新解析 xlsx 並覆寫
+    df = clean_score_df(pd.read_excel(path_str, sheet_name="score", engine=EXCEL_ENGINE))
+    if REQUIRED_COLS.issubset(df.columns):
+        try:
+            table = pa.Table.from_pandas(df)
+            table = table.replace_schema_metadata({**(table.schema.metadata or {}), SCORE_CACHE_META_KEY: tag})
+            pq.write_table(table, cache)
+        except Exception:
+            pass  # 目錄不可寫或欄位型別混雜：略過磁碟快取
+    return df
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def load_uploaded_score_df(blob: bytes) -> pd.DataFrame:
+    # 只以檔案內容為 key：rerun 時 UploadedFile 物件或檔名不同，但內容相同仍會命中
+    return clean_score_df(pd.read_excel(BytesIO(blob), sheet_name="score", engine=EXCEL_ENGINE))
+
 def load_score_df(file):
     if file is not None:
-        return pd.read_excel(file, sheet_name="score")
+        return load_uploaded_score_df(file.getvalue())
 
     # 預設本地檔
     candidates = [
@@ -67,65 +140,35 @@ def load_score_df(file):
     ]
     for p in candidates:
         if p.exists():
-            return pd.read_excel(p, sheet_name="score")
+            return load_default_score_df(str(p), p.stat().st_mtime_ns)
 
     st.error("未上傳檔案，且找不到預設檔")
     st.stop()
 
-# 讀檔
-df = load_score_df(uploaded)
+# 讀檔（已完成轉型）；淺 copy 即可：copy-on-write 下加欄位不會動到 cache 中的共用 DataFrame
+df = load_score_df(uploaded).copy(deep=False)
 
 # 基本欄位檢查
-required_cols = {"ID", "Biochem", "MolBio", "Week"}
-if not required_cols.issubset(df.columns):
-    st.error(f"缺少必要欄位：{required_cols - set(df.columns)}，請確認 'score' 工作表欄位至少包含 ID, Biochem, MolBio, Week。")
+if not REQUIRED_COLS.issubset(df.columns):
+    st.error(f"缺少必要欄位：{REQUIRED_COLS - set(df.columns)}，請確認 'score' 工作表欄位至少包含 ID, Biochem, MolBio, Week。")
     st.stop()
 
-# Name 欄可選；若沒有則補空白
-if "Name" not in df.columns:
-    df["Name"] = ""
-
-# 轉型與排序
-df["Week"] = pd.to_numeric(df["Week"], errors="coerce").astype("Int64")
-df = df.dropna(subset=["Week"]).copy()
-df["Week"] = df["Week"].astype(int)
-df = df.sort_values(["ID", "Week"])
-
 # 工具函式與衍生欄位
-def to_str_id(x):
-    try:
-        return str(x)
-    except Exception:
-        return ""
-
-df["ID_str"] = df["ID"].apply(to_str_id)
-
-def cohort_from_id(s: str) -> str:
-    try:
-        prefix = int(str(s)[:3])
-    except Exception:
-        return "未知"
-    if prefix < 413:
-        return "重修"
-    elif prefix == 413:
-        return "應屆"
-    else:
-        return "先修"
-
-def dept_from_id(s: str) -> str:
-    s = to_str_id(s)
-    code = s[3:5] if len(s) >= 5 else ""
-    if code == "01":
-        return "醫學系"
-    elif code == "02":
-        return "牙醫學系"
-    elif code == "03":
-        return "藥學系"
-    else:
-        return "未知"
-
-df["學籍分類"] = df["ID_str"].apply(cohort_from_id)
-df["系所"] = df["ID_str"].apply(dept_from_id)
+# 衍生欄位只跟學號有關：先 factorize 出不重複的學號（學生數遠少於成績列數），推導完再依代碼展回每列
+id_codes, uniq_ids = pd.factorize(df["ID"], use_na_sentinel=False)
+# Arrow 字串：下方的切片 / 轉數字在 Arrow compute 內完成，不逐列走 Python str 物件
+uniq_id_str = pd.Series(uniq_ids, dtype=object).astype("string[pyarrow]")
+df["ID_str"] = uniq_id_str.array.take(id_codes)
+
+DEPT_BY_CODE = {"01": "醫學系", "02": "牙醫學系", "03": "藥學系"}
+
+# 學籍：ID 前三碼 <413 重修、=413 應屆、>413 先修；無法解析 → 未知
+# 只有 3–4 種值：存成 category，下方 isin 篩選比對的是整數代碼而非逐列字串
+prefix = pd.to_numeric(uniq_id_str.str[:3], errors="coerce").astype(float)
+uniq_cohort = pd.Categorical(np.select([prefix < 413, prefix == 413, prefix > 413], ["重修", "應屆", "先修"], default="未知"))
+uniq_dept = pd.Categorical(uniq_id_str.str[3:5].map(DEPT_BY_CODE).fillna("未知"))
+df["學籍分類"] = uniq_cohort.take(id_codes)
+df["系所"] = uniq_dept.take(id_codes)
 
 # 多選篩選（pills）
 if cohort_opts:  # 若有選任何項目才過濾
@@ -136,48 +179,144 @@ if dept_opts:
 # 固定 18 週
 WEEKS_FULL = list(range(1, 19))
 
-# ID->Name 對照
-id_name_map = (
-    df.sort_values(["ID", "Week"])
-      .groupby("ID")["Name"]
-      .apply(lambda s: s.dropna().iloc[0] if len(s.dropna()) else "")
-)
+# 篩選後資料的雜湊：只動門檻 / 視窗滑桿時，pivot 與預警掃描直接命中 cache
+def frame_hash(df: pd.DataFrame) -> int:
+    return int(pd.util.hash_pandas_object(df, index=False).sum())
+
+df_hash = frame_hash(df)
 
 # 透視表（整數＋缺值 pd.NA；欄名轉字串；在 ID 後插入 Name）
-def make_pivot(subject_col: str) -> pd.DataFrame:
-    pivot = df.pivot(index="ID", columns="Week", values=subject_col).sort_index()
-    pivot = pivot.reindex(columns=WEEKS_FULL)
-    pivot = pivot.map(lambda x: int(x) if pd.notna(x) else pd.NA)
+SUBJECTS = ["Biochem", "MolBio"]
+
+def make_pivot(wide: pd.DataFrame, id_name_map: pd.Series, subject_col: str) -> pd.DataFrame:
+    pivot = wide[subject_col].copy()
     pivot.columns = pivot.columns.map(str)
-    pivot.insert(0, "Name", pivot.index.map(id_name_map).fillna(""))
+    pivot.insert(0, "Name", id_name_map.reindex(pivot.index, fill_value=""))
     return pivot
 
-bio_pivot = make_pivot("Biochem")
-mol_pivot = make_pivot("MolBio")
+# 底線開頭的參數不參與 Streamlit 的雜湊，改以 df_hash 當 key
+@st.cache_data(show_spinner=False)
+def compute_score_matrix(_df_score: pd.DataFrame, df_hash: int) -> pd.DataFrame:
+    # 學生 × (科目, 18 週) 的原始分數（缺週 NaN）：兩科一次 pivot，透視表與預警共用這一份
+    wide = _df_score.pivot(index="ID", columns="Week", values=SUBJECTS).sort_index()
+    wide = wide.reindex(columns=pd.MultiIndex.from_product([SUBJECTS, WEEKS_FULL], names=[None, "Week"]))
+    return wide.astype(float)
 
-# 著色（空白與字串不著色）
-def color_cell(v):
-    try:
-        if v == "" or isinstance(v, str):
-            return ""
-        x = float(v)
-    except Exception:
-        return ""
-    if x <= red_th:
-        return "background-color: #f8d7da;"
-    elif x <= yellow_th:
-        return "background-color: #fff3cd;"
-    else:
-        return "background-color: #d4edda;"
+@st.cache_data(show_spinner=False)
+def compute_pivots(_df_score: pd.DataFrame, _wide: pd.DataFrame, df_hash: int):
+    # ID->Name 對照：取每位學生最早一筆有姓名的紀錄（只依 Week 做穩定排序）
+    id_name_map = (
+        _df_score.dropna(subset=["Name"])
+                 .sort_values("Week", kind="stable")
+                 .drop_duplicates("ID", keep="first")
+                 .set_index("ID")["Name"]
+    )
+    shown = np.trunc(_wide).astype("Int64")
+    return make_pivot(shown, id_name_map, "Biochem"), make_pivot(shown, id_name_map, "MolBio")
+
+wide = compute_score_matrix(df, df_hash)
+bio_pivot, mol_pivot = compute_pivots(df, wide, df_hash)
+
+# 著色（空白與 Name 不著色）：整張表的 CSS 以 numpy 一次算好，不逐格呼叫 Python
+CELL_RED = "background-color: #f8d7da;"
+CELL_YELLOW = "background-color: #fff3cd;"
+CELL_GREEN = "background-color: #d4edda;"
+
+def pivot_colors(scores: pd.DataFrame) -> pd.DataFrame:
+    vals = scores.to_numpy(dtype=float, na_value=np.nan)
+    # NaN 與任何門檻比較皆為 False，落到預設的空字串
+    css = np.select([vals <= red_th, vals <= yellow_th, vals > yellow_th],
+                    [CELL_RED, CELL_YELLOW, CELL_GREEN], default="")
+    return pd.DataFrame(css, index=scores.index, columns=scores.columns)
+
+def style_pivot(pivot: pd.DataFrame):
+    score_cols = pivot.columns.drop("Name")
+    return pivot.style.format(na_rep="").apply(pivot_colors, axis=None, subset=score_cols)
 
 st.subheader("生物化學（Biochem）")
-st.dataframe(bio_pivot.style.map(color_cell), use_container_width=True)
+st.dataframe(style_pivot(bio_pivot), use_container_width=True)
 
 st.subheader("分子生物學（MolBio）")
-st.dataframe(mol_pivot.style.map(color_cell), use_container_width=True)
+st.dataframe(style_pivot(mol_pivot), use_container_width=True)
 
 # === AND 規則預警（任一科別同時滿足：紅≥min_red 且 紅+黃≥min_total） ===
+def window_counts(bio_vals: np.ndarray, mol_vals: np.ndarray,
+                  red_threshold: float, yellow_threshold: float, window_len: int):
+    """回傳 (視窗是否無缺值, Biochem 紅/黃數, MolBio 紅/黃數)，皆為 (學生數, 視窗數) 矩陣。"""
+    # 每格只和門檻比一次，存成 1 byte 的旗標矩陣；之後視窗只加總旗標，不再搬動整塊 float
+    def flags(vals):
+        red = (vals <= red_threshold).astype(np.int8)
+        yellow = ((vals > red_threshold) & (vals <= yellow_threshold)).astype(np.int8)
+        return red, yellow
+
+    bio_red, bio_yellow = flags(bio_vals)
+    mol_red, mol_yellow = flags(mol_vals)
+    valid = (~np.isnan(bio_vals) & ~np.isnan(mol_vals)).astype(np.int8)
+
+    # 沿週次做前綴和，第 i 個視窗（起始週 WEEKS_FULL[i]）的合計 = cs[:, i+window_len] - cs[:, i]；
+    # 重疊的週不重複加總
+    def counts(m):
+        cs = np.zeros((m.shape[0], m.shape[1] + 1), dtype=np.int16)
+        np.cumsum(m, axis=1, out=cs[:, 1:])
+        return cs[:, window_len:] - cs[:, :-window_len]
+
+    # 視窗內如有缺值 → 略過（可改成允許缺值但只計有分數週）
+    complete = counts(valid) == window_len
+    return complete, counts(bio_red), counts(bio_yellow), counts(mol_red), counts(mol_yellow)
+
+# 選配：裝了 numba 時，大班級改用編譯後的掃描：每位學生走訪 18 週一次、同時累加五組前綴和，
+# 不建中間旗標 / 前綴和矩陣。實測（18 週、W=4/10）編譯後每次約為 NumPy 版的 1/3–1/6，
+# 但 process 第一次呼叫要付載入 / 編譯成本（有磁碟快取約 0.4 秒，無則約 2 秒）；
+# 5 萬人時每次約省 20 ms，門檻設在這裡才划得來
+NUMBA_MIN_STUDENTS = 50_000
+
+@st.cache_resource(show_spinner=False)
+def load_numba_window_counts():
+    # 每次 rerun 都會重跑整支腳本：編譯後的函式放在 cache_resource，整個 process 只載入一次；
+    # cache=True 讓重啟後直接讀 __pycache__ 內的編譯結果
+    try:
+        from numba import njit
+    except ImportError:
+        return None
+
+    @njit(cache=True)
+    def window_counts_numba(bio_vals, mol_vals, red_threshold, yellow_threshold, window_len):
+        n, n_weeks = bio_vals.shape
+        n_win = n_weeks - window_len + 1
+        complete = np.zeros((n, n_win), dtype=np.bool_)
+        bio_r = np.zeros((n, n_win), dtype=np.int16)
+        bio_y = np.zeros((n, n_win), dtype=np.int16)
+        mol_r = np.zeros((n, n_win), dtype=np.int16)
+        mol_y = np.zeros((n, n_win), dtype=np.int16)
+        # 單一學生的前綴和，逐列重複使用
+        cs_valid = np.zeros(n_weeks + 1, dtype=np.int16)
+        cs_bio_r = np.zeros(n_weeks + 1, dtype=np.int16)
+        cs_bio_y = np.zeros(n_weeks + 1, dtype=np.int16)
+        cs_mol_r = np.zeros(n_weeks + 1, dtype=np.int16)
+        cs_mol_y = np.zeros(n_weeks + 1, dtype=np.int16)
+        for s in range(n):
+            for t in range(n_weeks):
+                b = bio_vals[s, t]
+                m = mol_vals[s, t]
+                # NaN 與門檻比較皆為 False，不會被計入紅 / 黃
+                cs_valid[t + 1] = cs_valid[t] + (0 if np.isnan(b) or np.isnan(m) else 1)
+                cs_bio_r[t + 1] = cs_bio_r[t] + (1 if b <= red_threshold else 0)
+                cs_bio_y[t + 1] = cs_bio_y[t] + (1 if red_threshold < b <= yellow_threshold else 0)
+                cs_mol_r[t + 1] = cs_mol_r[t] + (1 if m <= red_threshold else 0)
+                cs_mol_y[t + 1] = cs_mol_y[t] + (1 if red_threshold < m <= yellow_threshold else 0)
+            for i in range(n_win):
+                e = i + window_len
+                complete[s, i] = cs_valid[e] - cs_valid[i] == window_len
+                bio_r[s, i] = cs_bio_r[e] - cs_bio_r[i]
+                bio_y[s, i] = cs_bio_y[e] - cs_bio_y[i]
+                mol_r[s, i] = cs_mol_r[e] - cs_mol_r[i]
+                mol_y[s, i] = cs_mol_y[e] - cs_mol_y[i]
+        return complete, bio_r, bio_y, mol_r, mol_y
+
+    return window_counts_numba
+
 def window_any_subject_alert_AND(df_score: pd.DataFrame,
+                                 wide: pd.DataFrame,
                                  red_threshold: float,
                                  yellow_threshold: float,
                                  window_len: int,
@@ -190,59 +329,79 @@ def window_any_subject_alert_AND(df_score: pd.DataFrame,
     則觸發預警。
     例：min_red=2, min_total=4 → 2紅2黃、3紅1黃、4紅0黃皆觸發；1紅3黃不觸發。
     """
-    out_rows = []
     if df_score.empty:
         return pd.DataFrame(columns=["ID","Name","Weeks","Biochem_scores","MolBio_scores","觸發條件","視窗長度","學籍","系所"])
 
-    for sid, g in df_score.groupby("ID"):
-        g = g.set_index("Week").reindex(WEEKS_FULL)[["Biochem","MolBio"]]
-        for i in range(len(WEEKS_FULL) - window_len + 1):
-            win_weeks = WEEKS_FULL[i:i+window_len]
-            sub = g.loc[win_weeks, ["Biochem", "MolBio"]].copy()
-
-            # 視窗內如有缺值 → 略過（可改成允許缺值但只計有分數週）
-            if sub.isna().any().any():
-                continue
-
-            def counts(series):
-                reds = (series <= red_threshold).sum()
-                yellows = ((series > red_threshold) & (series <= yellow_threshold)).sum()
-                total = reds + yellows
-                return reds, yellows, total
-
-            bio_r, bio_y, bio_t = counts(sub["Biochem"])
-            mol_r, mol_y, mol_t = counts(sub["MolBio"])
-
-            triggers = []
-            if (bio_r >= min_red) and (bio_t >= min_total):
-                triggers.append(f"Biochem：紅≥{min_red} 且 紅+黃≥{min_total}（實得：紅{bio_r}、黃{bio_y}）")
-            if (mol_r >= min_red) and (mol_t >= min_total):
-                triggers.append(f"MolBio：紅≥{min_red} 且 紅+黃≥{min_total}（實得：紅{mol_r}、黃{mol_y}）")
-
-            if triggers:
-                sid_meta = df_score[df_score["ID"] == sid].iloc[0]
-                out_rows.append({
-                    "ID": sid,
-                    "Name": sid_meta.get("Name", ""),
-                    "Weeks": f"{win_weeks[0]}–{win_weeks[-1]}",
-                    "Biochem_scores": tuple(int(x) for x in sub["Biochem"].values),
-                    "MolBio_scores": tuple(int(x) for x in sub["MolBio"].values),
-                    "觸發條件": "；".join(triggers),
-                    "視窗長度": window_len,
-                    "學籍": sid_meta["學籍分類"],
-                    "系所": sid_meta["系所"],
-                })
-
-    if not out_rows:
+    # 直接取共用的 學生 × 18 週矩陣（缺週為 NaN），兩科列序相同
+    bio_vals = wide["Biochem"].to_numpy(dtype=float)
+    mol_vals = wide["MolBio"].to_numpy(dtype=float)
+
+    numba_counts = load_numba_window_counts() if len(wide) >= NUMBA_MIN_STUDENTS else None
+    if numba_counts is not None:
+        counted = numba_counts(bio_vals, mol_vals, float(red_threshold), float(yellow_threshold), window_len)
+    else:
+        counted = window_counts(bio_vals, mol_vals, red_threshold, yellow_threshold, window_len)
+    complete, bio_r, bio_y, mol_r, mol_y = counted
+
+    bio_hit = complete & (bio_r >= min_red) & (bio_r + bio_y >= min_total)
+    mol_hit = complete & (mol_r >= min_red) & (mol_r + mol_y >= min_total)
+
+    # 只對觸發的 (學生, 視窗) 組輸出明細；每組只出現一次，不需再去重
+    idx_s, idx_w = np.nonzero(bio_hit | mol_hit)
+    if len(idx_s) == 0:
         return pd.DataFrame(columns=["ID","Name","Weeks","Biochem_scores","MolBio_scores","觸發條件","視窗長度","學籍","系所"])
 
-    df_out = pd.DataFrame(out_rows)
-    df_out = df_out.drop_duplicates(subset=["ID","Weeks","觸發條件"])
-    return df_out
+    # 每位學生的基本資料（取該生最早一週的紀錄），依矩陣列序排好，以列位置一次取出
+    meta = (
+        df_score.sort_values("Week", kind="stable")
+                .drop_duplicates("ID")
+                .set_index("ID")
+                .loc[wide.index]
+    )
+
+    weeks = np.asarray(WEEKS_FULL)
+    start = pd.Series(weeks[idx_w]).astype(str)
+    end = pd.Series(weeks[idx_w + window_len - 1]).astype(str)
+
+    # 視窗內各週分數：(觸發數, window_len) 的整數矩陣，逐列轉成 tuple
+    cols = idx_w[:, None] + np.arange(window_len)
+    def window_scores(vals):
+        return list(map(tuple, vals[idx_s[:, None], cols].astype(int).tolist()))
+
+    def trigger_text(subject, hit, reds, yellows):
+        text = (f"{subject}：紅≥{min_red} 且 紅+黃≥{min_total}（實得：紅"
+                + pd.Series(reds[idx_s, idx_w]).astype(str) + "、黃"
+                + pd.Series(yellows[idx_s, idx_w]).astype(str) + "）")
+        return text.where(hit[idx_s, idx_w], "")
+
+    bio_text = trigger_text("Biochem", bio_hit, bio_r, bio_y)
+    mol_text = trigger_text("MolBio", mol_hit, mol_r, mol_y)
+    sep = np.where((bio_text != "") & (mol_text != ""), "；", "")
+
+    return pd.DataFrame({
+        "ID": wide.index[idx_s],
+        "Name": meta["Name"].to_numpy()[idx_s],
+        "Weeks": start + "–" + end,
+        "Biochem_scores": window_scores(bio_vals),
+        "MolBio_scores": window_scores(mol_vals),
+        "觸發條件": bio_text + sep + mol_text,
+        "視窗長度": window_len,
+        "學籍": meta["學籍分類"].to_numpy()[idx_s],
+        "系所": meta["系所"].to_numpy()[idx_s],
+    })
+
+@st.cache_data(show_spinner=False)
+def compute_alerts(_df_score: pd.DataFrame, _wide: pd.DataFrame, df_hash: int,
+                   red_threshold: float, yellow_threshold: float,
+                   window_len: int, min_red: int, min_total: int) -> pd.DataFrame:
+    return window_any_subject_alert_AND(_df_score, _wide, red_threshold, yellow_threshold,
+                                        window_len, min_red, min_total)
 
 # 呼叫（預設 win_len = min_total；可在進階設定改）
-alert_df = window_any_subject_alert_AND(
-    df_score=df,
+alert_df = compute_alerts(
+    _df_score=df,
+    _wide=wide,
+    df_hash=df_hash,
     red_threshold=red_th,
     yellow_threshold=yellow_th,
     window_len=int(win_len),
@@ -250,6 +409,14 @@ alert_df = window_any_subject_alert_AND(
     min_total=int(min_total),
 )
 
+def join_scores(scores: pd.Series) -> pd.Series:
+    # 每列 tuple 長度都等於視窗長度：展開成欄後逐週串接，字串運算次數只跟視窗長度有關
+    parts = pd.DataFrame(scores.tolist(), index=scores.index).astype(str)
+    out = parts.iloc[:, 0]
+    for c in parts.columns[1:]:
+        out = out + "、" + parts[c]
+    return out
+
 # 顯示區塊
 st.subheader(
     f"⚠️ 預警名單（視窗={int(win_len)} 週；條件：紅≥{int(min_red)} 且 紅+黃≥{int(min_total)}）"
@@ -258,33 +425,50 @@ if alert_df.empty:
     st.success("目前沒有符合預警條件的學生。")
 else:
     show = alert_df.copy()
-    if "Biochem_scores" in show.columns:
-        show["Biochem_scores"] = show["Biochem_scores"].apply(lambda xs: "、".join(map(str, xs)))
-    if "MolBio_scores" in show.columns:
-        show["MolBio_scores"] = show["MolBio_scores"].apply(lambda xs: "、".join(map(str, xs)))
+    for col in ["Biochem_scores", "MolBio_scores"]:
+        if col in show.columns:
+            show[col] = join_scores(show[col])
 
     cols = ["ID", "Name", "學籍", "系所", "Weeks", "Biochem_scores", "MolBio_scores"]
     cols = [c for c in cols if c in show.columns]
     st.dataframe(show[cols], use_container_width=True)
 
-# 匯出
-with st.expander("⬇️ 下載目前結果（Excel）"):
-    def to_excel_bytes():
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-            def unblank(df_in: pd.DataFrame) -> pd.DataFrame:
-                return df_in.replace("", pd.NA)
-            unblank(bio_pivot).to_excel(writer, sheet_name="Biochem_Pivot")
-            unblank(mol_pivot).to_excel(writer, sheet_name="MolBio_Pivot")
-            (alert_df if not alert_df.empty else pd.DataFrame(columns=[
-                "ID","Name","Weeks","Biochem_scores","MolBio_scores","觸發條件","視窗長度","學籍","系所"
-            ])).to_excel(writer, sheet_name=f"Alerts_AND_win{int(win_len)}", index=False)
-        output.seek(0)
-        return output
+# 匯出：xlsx 只在使用者按下下載時才產生（download_button 接受 callable）；
+# 同一組資料與參數重複下載時直接拿 cache 的 bytes，只保留最近幾組
+@st.cache_data(show_spinner=False, max_entries=4)
+def to_excel_bytes(_bio_pivot: pd.DataFrame, _mol_pivot: pd.DataFrame, _alert_df: pd.DataFrame,
+                   df_hash: int, red_threshold: float, yellow_threshold: float,
+                   window_len: int, min_red: int, min_total: int) -> bytes:
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+        # 與畫面相同的紅/黃/綠底色：交給 Excel 的條件式格式，不逐格處理
+        red_fmt = writer.book.add_format({"bg_color": "#f8d7da"})
+        yellow_fmt = writer.book.add_format({"bg_color": "#fff3cd"})
+        green_fmt = writer.book.add_format({"bg_color": "#d4edda"})
+        def color_sheet(pivot: pd.DataFrame, sheet_name: str):
+            if pivot.empty:
+                return
+            ws = writer.sheets[sheet_name]
+            # A 欄 ID、B 欄 Name，第 1 列為表頭；週次分數從 C2 開始
+            cells = (1, 2, len(pivot), len(pivot.columns))
+            ws.conditional_format(*cells, {"type": "blanks", "stop_if_true": True})
+            ws.conditional_format(*cells, {"type": "cell", "criteria": "<=", "value": red_threshold, "format": red_fmt})
+            ws.conditional_format(*cells, {"type": "cell", "criteria": "<=", "value": yellow_threshold, "format": yellow_fmt})
+            ws.conditional_format(*cells, {"type": "cell", "criteria": ">", "value": yellow_threshold, "format": green_fmt})
+        _bio_pivot.to_excel(writer, sheet_name="Biochem_Pivot")
+        color_sheet(_bio_pivot, "Biochem_Pivot")
+        _mol_pivot.to_excel(writer, sheet_name="MolBio_Pivot")
+        color_sheet(_mol_pivot, "MolBio_Pivot")
+        (_alert_df if not _alert_df.empty else pd.DataFrame(columns=[
+            "ID","Name","Weeks","Biochem_scores","MolBio_scores","觸發條件","視窗長度","學籍","系所"
+        ])).to_excel(writer, sheet_name=f"Alerts_AND_win{window_len}", index=False)
+    return output.getvalue()
 
+with st.expander("⬇️ 下載目前結果（Excel）"):
     st.download_button(
         label="下載 Excel",
-        data=to_excel_bytes(),
+        data=partial(to_excel_bytes, bio_pivot, mol_pivot, alert_df, df_hash, red_th, yellow_th,
+                     int(win_len), int(min_red), int(min_total)),
         file_name="score_dashboard_outputs.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     )
@@ -0,0 +1,25 @@
+import os
+import shutil
+from pathlib import Path
+
+from streamlit.testing.v1 import AppTest
+
+REPO = Path(__file__).resolve().parents[1]
+
+
+def test_appended_feedback_shows_when_mtime_is_unchanged(tmp_path, monkeypatch):
+    # 時間戳粗的檔案系統：追加一列後 mtime 可能與先前讀取時相同，仍要讀到新回饋
+    shutil.copytree(REPO / "data", tmp_path / "data", ignore=shutil.ignore_patterns("*.parquet"))
+    monkeypatch.chdir(tmp_path)
+
+    at = AppTest.from_file(str(REPO / "app.py"), default_timeout=60)
+    at.run()
+    fb = tmp_path / "data" / "feedbacks.csv"
+    stat = fb.stat()
+    with open(fb, "a", encoding="utf-8") as f:
+        f.write("A001,01-BIOCHEM-WEEKLY,same tick note,Teacher\n")
+    os.utime(fb, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    at.run()
+
+    assert not at.exception
+    assert any("same tick note" in df.value.to_string() for df in at.dataframe)
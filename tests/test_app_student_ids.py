@@ -0,0 +1,98 @@
+from pathlib import Path
+
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+
+APP = Path(__file__).resolve().parents[1] / "app.py"
+
+
+def run_app() -> AppTest:
+    at = AppTest.from_file(str(APP), default_timeout=60)
+    at.run()
+    return at
+
+
+def test_numeric_student_ids_match_uploaded_master(tmp_path, monkeypatch):
+    # 數字學號的 students.csv + 上傳後寫出的 parquet master（上傳一律以字串讀 student_id）
+    data = tmp_path / "data"
+    data.mkdir()
+    pd.DataFrame({
+        "student_id": [1001, 1002],
+        "name": ["Chen Wei", "Lin Yu"],
+        "program": ["MED", "DENT"],
+        "enrolled_year": [2025, 2025],
+    }).to_csv(data / "students.csv", index=False)
+    pd.DataFrame({
+        "student_id": [1001, 1002],
+        "week": [1, 1],
+        "subject": ["BIOCHEM", "BIOCHEM"],
+        "type": ["WEEKLY", "WEEKLY"],
+        "raw_score": [30, 80],
+    }).to_csv(data / "scores_master.csv", index=False)
+    pd.DataFrame({
+        "student_id": ["1001", "1002", "1001"],
+        "week": [1, 1, 2],
+        "subject": ["BIOCHEM", "BIOCHEM", "MOLBIO"],
+        "type": ["WEEKLY", "WEEKLY", "WEEKLY"],
+        "raw_score": [35.0, 80.0, 50.0],
+    }).to_parquet(data / "scores_master.parquet", index=False)
+    monkeypatch.chdir(tmp_path)
+
+    at = run_app()
+
+    assert not at.exception
+    merged = at.session_state["_merged"]
+    assert merged["student_id"].tolist().count("1001") == 2
+    assert merged["program"].notna().all()
+
+
+def test_numeric_student_ids_from_legacy_csv(tmp_path, monkeypatch):
+    data = tmp_path / "data"
+    data.mkdir()
+    pd.DataFrame({
+        "student_id": [1001],
+        "name": ["Chen Wei"],
+        "program": ["MED"],
+        "enrolled_year": [2025],
+    }).to_csv(data / "students.csv", index=False)
+    pd.DataFrame({
+        "student_id": [1001],
+        "week": [1],
+        "subject": ["BIOCHEM"],
+        "type": ["WEEKLY"],
+        "raw_score": [30],
+    }).to_csv(data / "scores_master.csv", index=False)
+    monkeypatch.chdir(tmp_path)
+
+    at = run_app()
+
+    assert not at.exception
+    merged = at.session_state["_merged"]
+    assert merged["student_id"].tolist() == ["1001"]
+    assert merged["program"].tolist() == ["MED"]
+
+
+def test_zero_padded_student_ids_survive_uploads(tmp_path, monkeypatch):
+    # 上傳的 students.csv 與成績都要保留前導 0，program 才 merge 得上
+    (tmp_path / "data").mkdir()
+    monkeypatch.chdir(tmp_path)
+
+    at = run_app()
+    at.file_uploader(key="stu_up").set_value((
+        "students.csv",
+        b"student_id,name,program,enrolled_year\n0123,Chen Wei,MED,2025\n",
+        "text/csv",
+    ))
+    at.file_uploader(key="scores_up").set_value([(
+        "scores.csv",
+        b"student_id,week,subject,type,raw_score\n0123,1,BIOCHEM,WEEKLY,30\n",
+        "text/csv",
+    )])
+    at.run()
+
+    assert not at.exception
+    students = pd.read_csv(tmp_path / "data" / "students.csv", dtype=str)
+    assert students["student_id"].tolist() == ["0123"]
+    merged = at.session_state["_merged"]
+    assert merged["student_id"].tolist() == ["0123"]
+    assert merged["program"].tolist() == ["MED"]